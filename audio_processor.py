@@ -1,33 +1,102 @@
 """Provides functions for audio file conversion."""
 
+from __future__ import annotations
+
 import logging
+import os
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from pydub import AudioSegment
-
 logger = logging.getLogger(__name__)
 
 
-def convert_all_aac_to_wav(source_dir: str, dest_dir: str) -> None:
+def _convert_one(aac_file: Path, dest_path: Path) -> None:
+    """
+    Convert a single AAC file to WAV format.
+
+    ffmpeg decodes and writes the file itself, so the decoded audio is never
+    held in memory by this process.
+
+    Args:
+        aac_file: The AAC file to convert.
+        dest_path: The directory to save the WAV file in.
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg fails to convert the file.
+        OSError: If ffmpeg cannot be run.
+
+    """
+    wav_file = dest_path / f"{aac_file.stem}.wav"
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        str(aac_file),
+        "-c:a",
+        "pcm_s16le",
+        str(wav_file),
+    ]
+    subprocess.run(command, check=True, capture_output=True)  # noqa: S603 - fixed argv, no shell
+    logger.info("Successfully converted %s to %s", aac_file, wav_file)
+
+
+def convert_all_aac_to_wav(
+    source_dir: str, dest_dir: str, max_workers: int | None = None
+) -> tuple[int, int]:
     """
     Convert all AAC audio files in a directory to WAV format.
 
+    Each conversion runs in its own ffmpeg process, so files are converted
+    concurrently from a thread pool.
+
     Args:
         source_dir: The path to the directory containing AAC files.
         dest_dir: The path to the directory to save the WAV files.
+        max_workers: The number of concurrent conversions. Defaults to the
+            number of CPUs.
+
+    Returns:
+        The number of files converted and the number that failed.
 
     """
     dest_path = Path(dest_dir)
     dest_path.mkdir(exist_ok=True)
 
-    for aac_file in Path(source_dir).glob("*.aac"):
-        wav_file = dest_path / f"{aac_file.stem}.wav"
-        try:
-            audio = AudioSegment.from_file(aac_file, format="aac")
-            audio.export(wav_file, format="wav")
-            logger.info("Successfully converted %s to %s", aac_file, wav_file)
-        except Exception:
-            logger.exception("Error converting %s", aac_file)
+    # scandir yields entries with their type already known, so files are
+    # found and submitted as the directory is read, without a stat each.
+    future_to_file: dict[Future[None], Path] = {}
+    converted = failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        with os.scandir(source_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".aac") and entry.is_file():
+                    aac_file = Path(entry.path)
+                    future = executor.submit(_convert_one, aac_file, dest_path)
+                    future_to_file[future] = aac_file
+
+        for future in as_completed(future_to_file):
+            aac_file = future_to_file[future]
+            try:
+                future.result()
+            except subprocess.CalledProcessError as error:
+                failed += 1
+                logger.exception(
+                    "Error converting %s: %s",
+                    aac_file,
+                    error.stderr.decode(errors="replace"),
+                )
+            except OSError:
+                failed += 1
+                logger.exception("Error running ffmpeg for %s", aac_file)
+            else:
+                converted += 1
+
+    logger.info("Converted %d files, %d failed", converted, failed)
+    return converted, failed
 
 
 if __name__ == "__main__":
@@ -5,26 +5,266 @@ Provides an enhanced downloader for Tencent Cloud COS.
 It supports multi-threaded concurrent downloads, resumable downloads,
 file filtering, and progress display.
 """
+
 from __future__ import annotations
 
 import argparse
 import hashlib
+import itertools
 import json
 import logging
+import os
+import queue
+import random
+import statistics
 import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
+import urllib3.exceptions
 from qcloud_cos import CosConfig, CosS3Client
-from qcloud_cos.cos_exception import CosServiceError
+from qcloud_cos.cos_exception import CosClientError, CosServiceError
 from tqdm import tqdm
 
+from cos_utils import build_session, drop_page_cache, iter_pages, unquote_etag
 from index_manager import IndexManager
 from sync_detector import SyncDetector
 
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+# Buffer size used when streaming downloads.
+CHUNK_SIZE = 1024 * 1024
+
+# Length of an MD5 hex digest, which is what a single-part ETag holds.
+MD5_HEX_LENGTH = 32
+
+# Median object sizes below/above which the automatic worker count is
+# scaled up (latency-bound small files) or down (bandwidth-bound large files).
+SMALL_OBJECT_SIZE = 1024 * 1024
+LARGE_OBJECT_SIZE = 64 * 1024 * 1024
+
+# When the worker count is tuned automatically, the number of in-flight
+# downloads is re-evaluated every ADAPTIVE_WINDOW seconds and moved by
+# ADAPTIVE_STEP, up to ADAPTIVE_MAX_WORKERS (or 8 * cpu_count if larger).
+# Throughput changes within ADAPTIVE_BAND of the previous window are noise.
+ADAPTIVE_WINDOW = 5.0
+ADAPTIVE_STEP = 4
+ADAPTIVE_BAND = 0.1
+ADAPTIVE_MAX_WORKERS = 64
+
+# Objects at least ``options.multipart_threshold_mb`` (default
+# LARGE_OBJECT_SIZE) bytes are fetched as parallel ranged GETs by the SDK,
+# using parts of RANGE_PART_SIZE_MB and RANGE_THREADS connections per object.
+RANGE_PART_SIZE_MB = 16
+RANGE_THREADS = 4
+
+# Number of listed objects buffered ahead of the download workers.
+PREFETCH_SIZE = 1024
+
+# Number of objects checked against the index in one query before download.
+SKIP_CHECK_BATCH_SIZE = 500
+
+# When objects arrive as an iterator, the worker count is chosen from the
+# sizes of this many leading objects (about one listing page).
+WORKER_SAMPLE_SIZE = 1000
+
+
+def _key_suffix(cos_key: str) -> str:
+    """
+    Return the lowercase file extension of an object key.
+
+    Equivalent to ``Path(cos_key).suffix.lower()`` without building a Path
+    for every listed object.
+
+    Args:
+        cos_key: The COS object key.
+
+    Returns:
+        The extension including the dot, or an empty string.
+
+    """
+    dot = cos_key.rfind(".")
+    if dot <= cos_key.rfind("/") + 1:
+        return ""
+    return cos_key[dot:].lower()
+
+
+def _local_size(path: Path) -> int:
+    """Return the size of a local file with a single stat, or -1 if missing."""
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return -1
+
+
+def _batched(
+    items: Iterable[dict[str, Any]], size: int
+) -> Iterator[list[dict[str, Any]]]:
+    """Yield successive lists of at most ``size`` items."""
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _prefetch(
+    items: Iterable[dict[str, Any]], maxsize: int = PREFETCH_SIZE
+) -> Iterator[dict[str, Any]]:
+    """
+    Consume an iterable on a background thread.
+
+    Up to ``maxsize`` items are buffered, so a paginated COS listing keeps
+    running while the caller is busy with earlier items. Exceptions raised
+    by the producer are re-raised to the caller.
+
+    Args:
+        items: The iterable to consume.
+        maxsize: The maximum number of buffered items.
+
+    Yields:
+        The items, in order.
+
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=maxsize)
+    end = object()
+    errors: list[BaseException] = []
+
+    def produce() -> None:
+        try:
+            for item in items:
+                buffer.put(item)
+        except BaseException as exc:  # noqa: BLE001 - re-raised by the consumer
+            errors.append(exc)
+        finally:
+            buffer.put(end)
+
+    threading.Thread(target=produce, name="cos-prefetch", daemon=True).start()
+    while (item := buffer.get()) is not end:
+        yield item
+    if errors:
+        raise errors[0]
+
+
+class _ConcurrencyTuner:
+    """
+    Adjust the number of in-flight downloads from observed throughput.
+
+    Every ``window`` seconds the byte rate of completed downloads is compared
+    with the previous window, as a hill climb: while the rate rises by more
+    than ``band`` the limit keeps moving ``step`` slots in the same
+    direction, a fall of more than ``band`` reverses the direction, and a
+    rate within the band holds the limit. Once adding downloads stops paying
+    off, the limit therefore stays near the knee instead of drifting down.
+    The limit stays within ``[step, maximum]``.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        maximum: int,
+        step: int = ADAPTIVE_STEP,
+        window: float = ADAPTIVE_WINDOW,
+        band: float = ADAPTIVE_BAND,
+    ) -> None:
+        """
+        Initialize the tuner.
+
+        Args:
+            initial: The initial number of in-flight downloads.
+            maximum: The largest number of in-flight downloads allowed.
+            step: How many slots to add or remove per adjustment.
+            window: The length of a measurement window, in seconds.
+            band: The relative rate change treated as noise.
+
+        """
+        self.limit = initial
+        self.maximum = maximum
+        self.step = step
+        self.window = window
+        self.band = band
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._last_rate = 0.0
+        self._direction = 1
+
+    def record(self, num_bytes: int) -> None:
+        """
+        Record a finished download and adjust the limit at window ends.
+
+        Args:
+            num_bytes: The number of bytes the download transferred.
+
+        """
+        self._window_bytes += num_bytes
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+        rate = self._window_bytes / elapsed
+        if rate < self._last_rate * (1 - self.band):
+            self._direction = -self._direction
+            self._move()
+        elif rate > self._last_rate * (1 + self.band):
+            self._move()
+        self._last_rate = rate
+        self._window_start = now
+        self._window_bytes = 0
+
+    def _move(self) -> None:
+        """Move the limit one step in the current direction."""
+        self.limit = min(
+            max(self.limit + self._direction * self.step, self.step), self.maximum
+        )
+
+
+class _BatchProgress:
+    """Tally the results of a download batch for the progress bar and tuner."""
+
+    def __init__(self, pbar: tqdm, tuner: _ConcurrencyTuner | None) -> None:
+        """
+        Initialize the tally.
+
+        Args:
+            pbar: The progress bar to advance.
+            tuner: The concurrency tuner to feed, if workers are tuned.
+
+        """
+        self.counts = {"success": 0, "failed": 0, "skipped": 0}
+        self.pbar = pbar
+        self.tuner = tuner
+
+    def skip(self) -> None:
+        """Record an object that did not need downloading."""
+        self.counts["skipped"] += 1
+        self.pbar.update(1)
+
+    def record(self, result: str, file_size: int) -> None:
+        """
+        Record a finished download.
+
+        Args:
+            result: The download result ('success', 'skipped', 'failed').
+            file_size: The size of the object.
+
+        """
+        self.counts[result] += 1
+        if self.tuner:
+            self.tuner.record(file_size if result == "success" else 0)
+        # set_postfix redraws by default; leave redrawing to update(), which
+        # is throttled by mininterval.
+        self.pbar.set_postfix(self.counts, refresh=False)
+        self.pbar.update(1)
+
 
 class EnhancedCOSDownloader:
     """An enhanced downloader for COS."""
@@ -32,7 +272,7 @@ class EnhancedCOSDownloader:
     def __init__(
         self,
         config_file: str = "config.json",
-        max_workers: int = 5,
+        max_workers: int | None = None,
         retry_times: int = 3,
     ) -> None:
         """
@@ -40,16 +280,36 @@ class EnhancedCOSDownloader:
 
         Args:
             config_file: Path to the configuration file.
-            max_workers: Maximum number of concurrent workers.
+            max_workers: Maximum number of concurrent workers. If None, it is
+                derived from the CPU count and tuned per batch of objects.
             retry_times: Number of times to retry a failed download.
 
         """
         self.config_file = Path(config_file)
-        self.max_workers = max_workers
+        self._cpu_count = os.cpu_count() or 4
+        self._auto_workers = max_workers is None
+        self.max_workers = max_workers or min(32, self._cpu_count * 4)
+        self._max_concurrency = (
+            max(ADAPTIVE_MAX_WORKERS, self._cpu_count * 8)
+            if self._auto_workers
+            else self.max_workers
+        )
         self.retry_times = retry_times
+        self.logger = self._setup_logger()
         self.config = self._load_config()
+        # Resolve the COS settings once rather than on every download.
+        self._cos_config = self.config["cos_config"] if self.config else {}
+        self._bucket = self._cos_config.get("bucket_name")
+        self._options = self.config.get("options", {}) if self.config else {}
+        self._max_keys = self._options.get("max_keys_per_request", 1000)
+        self._default_dir = self._options.get("download_dir", "downloads")
+        self._verify_md5 = bool(self._options.get("verify_md5", False))
+        self._multipart_threshold = (
+            int(self._options["multipart_threshold_mb"]) * 1024 * 1024
+            if "multipart_threshold_mb" in self._options
+            else LARGE_OBJECT_SIZE
+        )
         self.client = self._init_client()
-        self.logger = self._setup_logger()
         self.index_manager = IndexManager()
         self.sync_detector = SyncDetector(self.client, self.index_manager)
 
@@ -72,13 +332,18 @@ class EnhancedCOSDownloader:
         if not self.config:
             return None
 
-        cos_config = self.config["cos_config"]
+        cos_config = self._cos_config
         client_config = CosConfig(
             Region=cos_config["region"],
             SecretId=cos_config["secret_id"],
             SecretKey=cos_config["secret_key"],
         )
-        return CosS3Client(client_config)
+        # The SDK shares one class-wide session sized by whichever client was
+        # created first. Give this client its own pool, sized for the largest
+        # worker count a batch can use, so concurrent downloads reuse
+        # keep-alive connections instead of opening new ones.
+        session = build_session(self._max_concurrency * 2)
+        return CosS3Client(client_config, session=session)
 
     def _setup_logger(self) -> logging.Logger:
         """Set up the logger."""
@@ -109,18 +374,134 @@ class EnhancedCOSDownloader:
 
         return logger
 
+    def _worker_count(self, sizes: list[int]) -> int:
+        """
+        Choose the number of download workers for a batch of objects.
+
+        Small objects are dominated by request latency, so more requests are
+        kept in flight; large objects saturate bandwidth with fewer workers.
+        An explicitly configured worker count is always respected.
+
+        Args:
+            sizes: The sizes of the objects to download, in bytes.
+
+        Returns:
+            The number of workers to use.
+
+        """
+        if not self._auto_workers or not sizes:
+            return self.max_workers
+        median_size = statistics.median(sizes)
+        if median_size < SMALL_OBJECT_SIZE:
+            return self._cpu_count * 8
+        if median_size > LARGE_OBJECT_SIZE:
+            return self._cpu_count
+        return self.max_workers
+
     def _calculate_md5(self, file_path: Path) -> str | None:
         """Calculate the MD5 hash of a file."""
-        hash_md5 = hashlib.new("md5")
         try:
-            with file_path.open("rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+            return IndexManager.calculate_md5(str(file_path))
         except OSError:
             self.logger.exception("Error calculating MD5 for %s", file_path)
             return None
 
+    @staticmethod
+    def _md5_from_etag(etag: str) -> str | None:
+        """
+        Return the MD5 digest carried by an ETag, if it has one.
+
+        COS sets the ETag of a single-part upload to the hex MD5 of the object,
+        which is used to verify the downloaded content. Multipart ETags have a
+        ``-<parts>`` suffix and carry no usable digest.
+
+        Args:
+            etag: The ETag of the object, without surrounding quotes.
+
+        Returns:
+            The lowercase MD5 hex digest, or None for multipart ETags.
+
+        """
+        if len(etag) == MD5_HEX_LENGTH and "-" not in etag:
+            return etag.lower()
+        return None
+
+    def _stream_to_file(
+        self, cos_key: str, local_path: Path, file_size: int
+    ) -> tuple[str, float]:
+        """
+        Stream an object to disk, hashing it in the same pass.
+
+        Args:
+            cos_key: The COS object key.
+            local_path: The local file path.
+            file_size: The expected size of the object in bytes.
+
+        Returns:
+            The MD5 hex digest of the downloaded content and the modification
+            time of the written file.
+
+        Raises:
+            OSError: If fewer or more bytes than expected were received.
+
+        """
+        response = self.client.get_object(Bucket=self._bucket, Key=cos_key)
+        # Read the undecoded body: an object stored with a Content-Encoding
+        # must be saved as stored, or its size and MD5 will not match.
+        raw = response["Body"].get_raw_stream()
+        hash_md5 = hashlib.new("md5", usedforsecurity=False)
+        bytes_written = 0
+        with local_path.open("wb") as f:
+            while chunk := raw.read(CHUNK_SIZE, decode_content=False):
+                f.write(chunk)
+                hash_md5.update(chunk)
+                bytes_written += len(chunk)
+            # Take the mtime from the open descriptor rather than another stat.
+            f.flush()
+            mtime = os.fstat(f.fileno()).st_mtime
+            # The file has already been hashed and is not read back.
+            drop_page_cache(f)
+        if bytes_written != file_size:
+            msg = (
+                f"Incomplete download for {cos_key}: {bytes_written}/{file_size} bytes"
+            )
+            raise OSError(msg)
+        return hash_md5.hexdigest(), mtime
+
+    def _download_ranged(
+        self, cos_key: str, local_path: Path, etag_md5: str | None
+    ) -> tuple[str | None, float]:
+        """
+        Download a large object as parallel ranged GETs.
+
+        A single connection is limited by its TCP window, so large objects are
+        split into parts fetched concurrently by the SDK's download_file. The
+        parts arrive out of order, so they cannot be hashed while streaming:
+        a single-part ETag is trusted as the MD5 unless ``options.verify_md5``
+        is set, and other files are hashed after they are complete.
+
+        Args:
+            cos_key: The COS object key.
+            local_path: The local file path.
+            etag_md5: The MD5 carried by the object's ETag, if any.
+
+        Returns:
+            The MD5 hex digest of the downloaded file (None on read errors)
+            and its modification time.
+
+        """
+        self.client.download_file(
+            Bucket=self._bucket,
+            Key=cos_key,
+            DestFilePath=str(local_path),
+            PartSize=RANGE_PART_SIZE_MB,
+            MAXThread=RANGE_THREADS,
+        )
+        mtime = local_path.stat().st_mtime
+        if etag_md5 and not self._verify_md5:
+            return etag_md5, mtime
+        return self._calculate_md5(local_path), mtime
+
     def _download_single_file(
         self, cos_key: str, local_path: Path, file_size: int, etag: str
     ) -> str:
@@ -130,95 +511,104 @@ class EnhancedCOSDownloader:
         Args:
             cos_key: The COS object key.
             local_path: The local file path.
-            file_size: The file size (for progress display).
+            file_size: The file size, used to verify the download.
             etag: The ETag of the file.
 
         Returns:
             A string indicating the result ('success', 'skipped', 'failed').
 
         """
-        cos_config = self.config["cos_config"]
-
-        if self.index_manager.file_exists(cos_key, etag):
-            self.logger.info("File already indexed, skipping: %s", cos_key)
+        if _local_size(local_path) == file_size:
+            self.logger.debug("File already exists, skipping: %s", cos_key)
             return "skipped"
 
-        if local_path.exists() and local_path.stat().st_size == file_size:
-            self.logger.info("File already exists, skipping: %s", cos_key)
-            return "skipped"
+        expected_md5 = self._md5_from_etag(etag)
+        for attempt in range(self.retry_times):
+            try:
+                self._download_and_index(
+                    cos_key, local_path, file_size, etag, expected_md5
+                )
+            except (  # noqa: PERF203 - each attempt must be retried
+                CosClientError,
+                CosServiceError,
+                OSError,
+                # Connection errors while reading the raw body are not OSErrors.
+                urllib3.exceptions.HTTPError,
+            ):
+                self.logger.warning(
+                    "Download failed (attempt %d/%d): %s",
+                    attempt + 1,
+                    self.retry_times,
+                    cos_key,
+                )
+                if attempt == self.retry_times - 1:
+                    self.logger.exception("Download finally failed: %s", cos_key)
+                    # A full-size but corrupt file would be skipped by the size
+                    # check on every later run, so it is never repaired.
+                    local_path.unlink(missing_ok=True)
+                    return "failed"
+                # Jitter keeps workers that failed together during a transient
+                # outage from retrying in lockstep.
+                time.sleep(2**attempt + random.uniform(0, 1))  # noqa: S311 - retry jitter, not security
+            else:
+                self.logger.debug("Successfully downloaded: %s", cos_key)
+                return "success"
+        return "failed"
 
-        local_path.parent.mkdir(parents=True, exist_ok=True)
+    def _download_and_index(
+        self,
+        cos_key: str,
+        local_path: Path,
+        file_size: int,
+        etag: str,
+        expected_md5: str | None,
+    ) -> None:
+        """
+        Download a file once, verify it and queue its index record.
 
-        try:
-            for attempt in range(self.retry_times):
-                try:
-                    self.client.download_file(
-                        Bucket=cos_config["bucket_name"],
-                        Key=cos_key,
-                        DestFilePath=str(local_path),
-                    )
-                    md5_hash = self._calculate_md5(local_path)
-                    last_modified = datetime.fromtimestamp(
-                        local_path.stat().st_mtime, tz=timezone.utc
-                    ).isoformat()
-                    self.index_manager.add_file(
-                        file_path=str(local_path),
-                        file_size=file_size,
-                        last_modified=last_modified,
-                        md5_hash=md5_hash,
-                        cos_key=cos_key,
-                        etag=etag,
-                    )
-                    self.logger.info("Successfully downloaded: %s", cos_key)
-                    return "success"
-                except (CosServiceError, OSError):
-                    self.logger.warning(
-                        "Download failed (attempt %d/%d): %s",
-                        attempt + 1,
-                        self.retry_times,
-                        cos_key,
-                    )
-                    if attempt < self.retry_times - 1:
-                        time.sleep(2**attempt)
-                    else:
-                        raise
-        except (CosServiceError, OSError):
-            self.logger.exception("Download finally failed: %s", cos_key)
-            return "failed"
-        return "failed"
+        Args:
+            cos_key: The COS object key.
+            local_path: The local file path.
+            file_size: The file size, used to verify the download.
+            etag: The ETag of the file.
+            expected_md5: The MD5 the file must have, if it is known.
 
-    def _list_objects_paginated(
-        self, prefix: str, max_keys: int
-    ) -> list[dict[str, Any]]:
-        """List objects from COS in a paginated manner."""
-        all_objects = []
-        marker = ""
-        cos_config = self.config["cos_config"]
-        while True:
-            response = self.client.list_objects(
-                Bucket=cos_config["bucket_name"],
-                Prefix=prefix,
-                Marker=marker,
-                MaxKeys=max_keys,
-            )
-            if "Contents" in response:
-                all_objects.extend(response["Contents"])
-                self.logger.info("Fetched %d objects...", len(all_objects))
-            if response.get("IsTruncated") == "true":
-                marker = response["NextMarker"]
-            else:
-                break
-        return all_objects
+        Raises:
+            OSError: If the file could not be written or does not verify.
 
-    def list_objects(
+        """
+        if file_size >= self._multipart_threshold:
+            md5_hash, mtime = self._download_ranged(cos_key, local_path, expected_md5)
+        else:
+            md5_hash, mtime = self._stream_to_file(cos_key, local_path, file_size)
+        if expected_md5 and md5_hash != expected_md5:
+            msg = f"MD5 mismatch for {cos_key}"
+            raise OSError(msg)
+        last_modified = datetime.fromtimestamp(mtime, tz=timezone.utc).isoformat()
+        self.index_manager.queue_file(
+            {
+                "file_path": str(local_path),
+                "file_size": file_size,
+                "last_modified": last_modified,
+                "md5_hash": md5_hash,
+                "cos_key": cos_key,
+                "etag": etag,
+            }
+        )
+
+    def iter_objects(
         self,
         prefix: str | None = None,
         extensions: list[str] | None = None,
         min_size: int | None = None,
         max_size: int | None = None,
-    ) -> list[dict[str, Any]]:
+    ) -> Iterator[dict[str, Any]]:
         """
-        List objects in COS.
+        Iterate over objects in COS, page by page.
+
+        Objects are filtered as each page arrives, so downloads can start
+        before the listing has finished. Listing errors are logged and end
+        the iteration.
 
         Args:
             prefix: The prefix to filter by.
@@ -226,46 +616,65 @@ class EnhancedCOSDownloader:
             min_size: The minimum file size.
             max_size: The maximum file size.
 
-        Returns:
-            A list of objects.
+        Yields:
+            The objects matching the filters.
 
         """
-        cos_config = self.config["cos_config"]
-        options = self.config.get("options", {})
-
         if prefix is None:
-            prefix = options.get("prefix", "")
+            prefix = self._options.get("prefix", "")
 
-        max_keys = options.get("max_keys_per_request", 1000)
-
-        self.logger.info(
-            "Fetching objects from bucket '%s'...", cos_config["bucket_name"]
-        )
+        self.logger.info("Fetching objects from bucket '%s'...", self._bucket)
         if prefix:
             self.logger.info("Filtering by prefix: %s", prefix)
 
+        # Resolve the filters once; the loop below runs for every listed key.
+        extension_set = frozenset(ext.lower() for ext in extensions or ())
+        min_size = min_size or 0
+        max_size = max_size or float("inf")
+
+        matched_count = 0
+        pages = iter_pages(self.client, self._bucket, prefix, max_keys=self._max_keys)
         try:
-            all_objects = self._list_objects_paginated(prefix, max_keys)
-        except (CosServiceError, OSError, ValueError):
+            for obj in itertools.chain.from_iterable(
+                page.get("Contents", ()) for page in pages
+            ):
+                if extension_set and _key_suffix(obj["Key"]) not in extension_set:
+                    continue
+                if not min_size <= int(obj["Size"]) <= max_size:
+                    continue
+                matched_count += 1
+                yield obj
+        except (CosClientError, CosServiceError, OSError, ValueError):
             self.logger.exception("Error listing objects")
-            return []
+            return
+
+        self.logger.info("Total objects fetched: %d", matched_count)
+
+    def list_objects(
+        self,
+        prefix: str | None = None,
+        extensions: list[str] | None = None,
+        min_size: int | None = None,
+        max_size: int | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        List objects in COS.
 
-        filtered_objects = []
-        for obj in all_objects:
-            if extensions and Path(obj["Key"]).suffix.lower() not in extensions:
-                continue
-            if min_size and int(obj["Size"]) < min_size:
-                continue
-            if max_size and int(obj["Size"]) > max_size:
-                continue
-            filtered_objects.append(obj)
+        Args:
+            prefix: The prefix to filter by.
+            extensions: A list of file extensions to filter by.
+            min_size: The minimum file size.
+            max_size: The maximum file size.
 
-        self.logger.info("Total objects fetched: %d", len(filtered_objects))
-        return filtered_objects
+        Returns:
+            A list of objects.
+
+        """
+        return list(self.iter_objects(prefix, extensions, min_size, max_size))
 
     def download_objects(
         self,
-        objects: list[dict[str, Any]],
+        objects: Iterable[dict[str, Any]],
         output_dir: str | None = None,
         *,
         show_progress: bool = True,
@@ -273,8 +682,13 @@ class EnhancedCOSDownloader:
         """
         Download a list of objects.
 
+        If ``objects`` is an iterator (e.g. from ``iter_objects``), it is
+        consumed on a background thread and downloads start while it is still
+        producing objects. The worker count is then chosen from the first
+        WORKER_SAMPLE_SIZE objects.
+
         Args:
-            objects: The list of objects to download.
+            objects: The objects to download.
             output_dir: The output directory.
             show_progress: Whether to show a progress bar.
 
@@ -282,89 +696,146 @@ class EnhancedCOSDownloader:
             A dictionary with download statistics.
 
         """
-        if not objects:
-            self.logger.warning("No objects to download.")
-            return {"success": 0, "failed": 0, "skipped": 0}
-
-        options = self.config.get("options", {})
         if output_dir is None:
-            output_dir = options.get("download_dir", "downloads")
+            output_dir = self._default_dir
 
+        # Keys are flattened into file names, so every download lands directly
+        # in output_path and it only needs to be created once per batch.
         output_path = Path(output_dir)
-        output_path.mkdir(exist_ok=True)
-
-        download_tasks = []
-        for obj in objects:
-            cos_key = obj["Key"]
-            local_path = output_path / cos_key.replace("/", "_")
-            download_tasks.append(
-                (cos_key, local_path, int(obj["Size"]), obj["ETag"].strip('"'))
-            )
+        output_path.mkdir(parents=True, exist_ok=True)
 
-        success_count = 0
-        failed_count = 0
-        skipped_count = 0
+        if isinstance(objects, list):
+            total = len(objects)
+            workers = self._worker_count([int(obj["Size"]) for obj in objects])
+        else:
+            total = None
+            objects = _prefetch(objects)
+            sample = list(itertools.islice(objects, WORKER_SAMPLE_SIZE))
+            workers = self._worker_count([int(obj["Size"]) for obj in sample])
+            objects = itertools.chain(sample, objects)
+
+        # Bound the number of queued futures so memory does not grow with the
+        # size of the listing. With automatic tuning the pool can grow to the
+        # concurrency cap and the tuner decides how many downloads run at once.
+        if self._auto_workers:
+            tuner = _ConcurrencyTuner(workers, self._max_concurrency)
+            pool_size = self._max_concurrency
+        else:
+            tuner = None
+            pool_size = workers
+        max_pending = workers * 2
+        pending: dict[Future[str], tuple[str, int]] = {}
+
+        self.logger.info("Starting download to: %s", output_path)
+
+        with (
+            ThreadPoolExecutor(max_workers=pool_size) as executor,
+            tqdm(
+                total=total,
+                desc="Downloading",
+                disable=not show_progress,
+                mininterval=1.0,
+            ) as pbar,
+        ):
+            progress = _BatchProgress(pbar, tuner)
+            for cos_key, file_size, etag in self._iter_unindexed(objects, progress):
+                if tuner:
+                    max_pending = tuner.limit
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done, pending, progress)
+                future = executor.submit(
+                    self._download_single_file,
+                    cos_key,
+                    output_path / cos_key.replace("/", "_"),
+                    file_size,
+                    etag,
+                )
+                pending[future] = (cos_key, file_size)
 
-        self.logger.info(
-            "Starting download of %d objects to: %s",
-            len(download_tasks),
-            output_path,
-        )
+            self._collect(as_completed(list(pending)), pending, progress)
 
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, tqdm(
-            total=len(download_tasks),
-            desc="Downloading",
-            disable=not show_progress,
-        ) as pbar:
-            future_to_task = {
-                executor.submit(self._download_single_file, *task): task
-                for task in download_tasks
-            }
+        self.index_manager.flush()
 
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
-                try:
-                    result = future.result()
-                    if result == "success":
-                        success_count += 1
-                    elif result == "failed":
-                        failed_count += 1
-                    elif result == "skipped":
-                        skipped_count += 1
-                except (OSError, ValueError):
-                    self.logger.exception("Task execution error for %s", task[0])
-                    failed_count += 1
-
-                pbar.update(1)
-                pbar.set_postfix(
-                    {
-                        "success": success_count,
-                        "failed": failed_count,
-                        "skipped": skipped_count,
-                    }
-                )
+        counts = progress.counts
+
+        if not any(counts.values()):
+            self.logger.warning("No objects to download.")
+            return counts
 
         self._generate_download_report(
-            success_count, failed_count, skipped_count, str(output_path)
+            counts["success"], counts["failed"], counts["skipped"], str(output_path)
         )
 
-        return {
-            "success": success_count,
-            "failed": failed_count,
-            "skipped": skipped_count,
-        }
+        return counts
+
+    def _iter_unindexed(
+        self, objects: Iterable[dict[str, Any]], progress: _BatchProgress
+    ) -> Iterator[tuple[str, int, str]]:
+        """
+        Yield the objects that are not already in the index.
+
+        Indexed objects are counted as skipped here, with one query per batch,
+        instead of occupying a worker each.
+
+        Args:
+            objects: The objects to download.
+            progress: The tally that skipped objects are recorded in.
+
+        Yields:
+            The key, size and unquoted ETag of each object to download.
+
+        """
+        for batch in _batched(objects, SKIP_CHECK_BATCH_SIZE):
+            tasks = [
+                (obj["Key"], int(obj["Size"]), unquote_etag(obj["ETag"]))
+                for obj in batch
+            ]
+            indexed = self.index_manager.file_exists_many(
+                (cos_key, etag) for cos_key, _, etag in tasks
+            )
+            for task in tasks:
+                if (task[0], task[2]) in indexed:
+                    progress.skip()
+                else:
+                    yield task
+
+    def _collect(
+        self,
+        done: Iterable[Future[str]],
+        pending: dict[Future[str], tuple[str, int]],
+        progress: _BatchProgress,
+    ) -> None:
+        """
+        Record the results of finished downloads.
+
+        Args:
+            done: The finished futures.
+            pending: The in-flight futures, mapped to their key and size.
+                Finished futures are removed from it.
+            progress: The tally to record the results in.
+
+        """
+        for future in done:
+            cos_key, file_size = pending.pop(future)
+            try:
+                result = future.result()
+            except (
+                CosClientError,
+                CosServiceError,
+                OSError,
+                ValueError,
+                urllib3.exceptions.HTTPError,
+            ):
+                self.logger.exception("Task execution error for %s", cos_key)
+                result = "failed"
+            progress.record(result, file_size)
 
     def sync_objects(self, prefix: str = "") -> None:
         """Synchronize objects from COS to the local directory."""
-        cos_config = self.config["cos_config"]
-        bucket_name = cos_config["bucket_name"]
-
         self.logger.info("Starting synchronization...")
 
-        remote_objects = self.sync_detector.list_remote_objects(bucket_name, prefix)
-        local_files = self.sync_detector.get_local_files()
-
-        diff = self.sync_detector.compare_objects(remote_objects, local_files)
+        diff = self.sync_detector.detect_changes(self._bucket, prefix)
 
         new_files = diff["new"]
         updated_files = diff["updated"]
@@ -393,11 +864,11 @@ class EnhancedCOSDownloader:
         """Generate a download report."""
         log_dir = Path("logs")
         log_dir.mkdir(exist_ok=True)
-        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        report_file = log_dir / f"download_report_{timestamp}.json"
+        now = datetime.now(timezone.utc)
+        report_file = log_dir / f"download_report_{now.strftime('%Y%m%d_%H%M%S')}.json"
 
         report = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now.isoformat(),
             "output_dir": output_dir,
             "statistics": {
                 "success": success_count,
@@ -432,7 +903,9 @@ def main() -> int:
         "--config", default="config.json", help="Path to the configuration file."
     )
     parser.add_argument(
-        "--workers", type=int, default=5, help="Number of concurrent workers."
+        "--workers",
+        type=int,
+        help="Number of concurrent workers (default: tuned automatically).",
     )
     parser.add_argument(
         "--retry",
@@ -455,6 +928,13 @@ def main() -> int:
 
     args = parser.parse_args()
 
+    # These flags are process-wide, so they are set here rather than by the
+    # downloader. Our formatter does not use thread or process fields, so
+    # skip collecting them for every record emitted by the download workers.
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
     downloader = EnhancedCOSDownloader(
         config_file=args.config, max_workers=args.workers, retry_times=args.retry
     )
@@ -467,23 +947,23 @@ def main() -> int:
         if args.sync:
             downloader.sync_objects(prefix=args.prefix)
         else:
-            objects = downloader.list_objects(
+            objects = downloader.iter_objects(
                 prefix=args.prefix,
                 extensions=args.extensions,
                 min_size=args.min_size,
                 max_size=args.max_size,
             )
 
-            if not objects:
-                downloader.logger.info("No matching objects found.")
-                return 0
-
             result = downloader.download_objects(
                 objects=objects,
                 output_dir=args.output_dir,
                 show_progress=not args.no_progress,
             )
 
+            if not any(result.values()):
+                downloader.logger.info("No matching objects found.")
+                return 0
+
             downloader.logger.info("Download complete:")
             downloader.logger.info("  Success: %d", result["success"])
             downloader.logger.info("  Failed: %d", result["failed"])
@@ -495,7 +975,7 @@ def main() -> int:
     except KeyboardInterrupt:
         downloader.logger.info("User interrupted the download.")
         return 1
-    except (OSError, ValueError, KeyError):
+    except (CosClientError, CosServiceError, OSError, ValueError, KeyError):
         downloader.logger.exception("An error occurred")
         return 1
     finally:
@@ -1,22 +1,48 @@
 #!/usr/bin/env python3
 """A tool for fetching objects from Tencent Cloud COS."""
 
+from __future__ import annotations
+
 import json
 import logging
 import sys
 import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
+import urllib3.exceptions
 from qcloud_cos import CosConfig, CosS3Client
-from qcloud_cos.cos_exception import CosServiceError
+from qcloud_cos.cos_exception import CosClientError, CosServiceError
+
+from cos_utils import build_session, drop_page_cache, iter_pages, unquote_etag
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+# Buffer size used when streaming object bodies to disk.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Number of objects downloaded concurrently.
+MAX_WORKERS = 32
 
 
 class COSObjectDownloader:
     """A tool for downloading objects from COS."""
 
     def __init__(
-        self, secret_id: str, secret_key: str, region: str, bucket_name: str
+        self,
+        secret_id: str,
+        secret_key: str,
+        region: str,
+        bucket_name: str,
+        max_workers: int = MAX_WORKERS,
     ) -> None:
         """
         Initialize the COS client.
@@ -26,16 +52,24 @@ class COSObjectDownloader:
             secret_key: The Tencent Cloud SecretKey.
             region: The COS region, e.g., ap-beijing-1.
             bucket_name: The name of the bucket.
+            max_workers: The number of concurrent requests (downloads, or
+                prefixes being listed).
+
         """
         self.secret_id = secret_id
         self.secret_key = secret_key
         self.region = region
         self.bucket_name = bucket_name
+        self.max_workers = max_workers
 
         config = CosConfig(
-            Region=self.region, SecretId=self.secret_id, SecretKey=self.secret_key
+            Region=self.region,
+            SecretId=self.secret_id,
+            SecretKey=self.secret_key,
         )
-        self.client = CosS3Client(config)
+        # Give the client its own pool with one connection per worker, so
+        # concurrent requests do not queue for a connection or reopen one.
+        self.client = CosS3Client(config, session=build_session(self.max_workers))
         self.logger = logging.getLogger("COSObjectDownloader")
 
     def list_all_objects(
@@ -50,43 +84,32 @@ class COSObjectDownloader:
 
         Returns:
             A list of all objects.
+
         """
         all_objects = []
-        marker = ""
 
         self.logger.info("Fetching objects from bucket '%s'...", self.bucket_name)
-        self.logger.info("Prefix filter: %s", prefix if prefix else "All objects")
+        self.logger.info("Prefix filter: %s", prefix or "All objects")
 
         start_time = time.time()
-
-        while True:
-            try:
-                response = self.client.list_objects(
-                    Bucket=self.bucket_name,
-                    Prefix=prefix,
-                    Marker=marker,
-                    MaxKeys=max_keys,
-                )
-
-                if "Contents" in response:
-                    objects = response["Contents"]
-                    all_objects.extend(objects)
+        last_log_time = 0.0
+
+        try:
+            for response in iter_pages(
+                self.client, self.bucket_name, prefix, max_keys=max_keys
+            ):
+                all_objects.extend(response.get("Contents", ()))
+                # Report progress at most once per second on long listings.
+                now = time.monotonic()
+                if now - last_log_time >= 1.0:
                     self.logger.info("Fetched %d objects...", len(all_objects))
+                    last_log_time = now
+        except (CosClientError, CosServiceError, OSError, ValueError):
+            self.logger.exception("Error listing objects under %r", prefix)
+            raise
 
-                    if response.get("IsTruncated") == "true":
-                        marker = response["NextMarker"]
-                    else:
-                        break
-                else:
-                    self.logger.info("Bucket is empty or no matching objects found.")
-                    break
-
-            except CosServiceError:
-                self.logger.exception("Error listing objects")
-                break
-            except (OSError, ValueError):
-                self.logger.exception("An unknown error occurred")
-                break
+        if not all_objects:
+            self.logger.info("Bucket is empty or no matching objects found.")
 
         elapsed_time = time.time() - start_time
         self.logger.info(
@@ -96,33 +119,120 @@ class COSObjectDownloader:
         )
         return all_objects
 
-    def get_object_info(self, objects: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    def _list_shard(self, prefix: str, max_keys: int) -> list[dict[str, Any]]:
         """
-        Get detailed information for objects.
+        List every object under a prefix without logging progress.
 
         Args:
-            objects: A list of objects.
+            prefix: The object prefix to list.
+            max_keys: The maximum number of objects to return per request.
 
         Returns:
-            A list of detailed object information.
+            The objects under the prefix.
+
         """
-        object_info_list = []
+        return [
+            obj
+            for response in iter_pages(
+                self.client, self.bucket_name, prefix, max_keys=max_keys
+            )
+            for obj in response.get("Contents", ())
+        ]
+
+    def list_all_objects_parallel(
+        self, prefix: str = "", max_keys: int = 1000
+    ) -> list[dict[str, Any]]:
+        """
+        Get all objects in the bucket, listing top-level prefixes concurrently.
+
+        Pagination within a prefix is sequential, because each marker comes
+        from the previous page. The keyspace is therefore first split on "/",
+        and then each common prefix is paginated on its own thread.
+
+        Args:
+            prefix: The object prefix to filter by.
+            max_keys: The maximum number of objects to return per request.
+
+        Returns:
+            A list of all objects.
+
+        """
+        all_objects = []
+        shards = []
+
+        self.logger.info("Fetching objects from bucket '%s'...", self.bucket_name)
+        self.logger.info("Prefix filter: %s", prefix or "All objects")
         start_time = time.time()
 
+        try:
+            for response in iter_pages(
+                self.client, self.bucket_name, prefix, delimiter="/", max_keys=max_keys
+            ):
+                all_objects.extend(response.get("Contents", ()))
+                shards.extend(
+                    entry["Prefix"] for entry in response.get("CommonPrefixes", ())
+                )
+
+            if shards:
+                self.logger.info("Listing %d prefixes in parallel...", len(shards))
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    for objects in executor.map(
+                        lambda shard: self._list_shard(shard, max_keys), shards
+                    ):
+                        all_objects.extend(objects)
+        except (CosClientError, CosServiceError, OSError, ValueError):
+            self.logger.exception("Error listing objects under %r", prefix)
+            raise
+
+        elapsed_time = time.time() - start_time
+        self.logger.info(
+            "Total objects fetched: %d, time taken: %.2f seconds",
+            len(all_objects),
+            elapsed_time,
+        )
+        return all_objects
+
+    @staticmethod
+    def _iter_object_info(
+        objects: Iterable[dict[str, Any]],
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Yield detailed information for objects, one at a time.
+
+        Args:
+            objects: The objects to describe.
+
+        Yields:
+            The detailed information of each object.
+
+        """
         for obj in objects:
             last_modified = obj["LastModified"]
             if hasattr(last_modified, "isoformat"):
                 last_modified_str = last_modified.isoformat()
             else:
                 last_modified_str = str(last_modified)
-            info = {
+            yield {
                 "key": obj["Key"],
                 "size": obj["Size"],
                 "last_modified": last_modified_str,
-                "etag": obj["ETag"].strip('"'),
+                "etag": unquote_etag(obj["ETag"]),
                 "storage_class": obj.get("StorageClass", "STANDARD"),
             }
-            object_info_list.append(info)
+
+    def get_object_info(self, objects: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        Get detailed information for objects.
+
+        Args:
+            objects: A list of objects.
+
+        Returns:
+            A list of detailed object information.
+
+        """
+        start_time = time.time()
+        object_info_list = list(self._iter_object_info(objects))
 
         elapsed_time = time.time() - start_time
         self.logger.info("Time taken to get object info: %.2f seconds", elapsed_time)
@@ -137,13 +247,27 @@ class COSObjectDownloader:
         Args:
             objects: A list of objects.
             filename: The output filename.
+
         """
         start_time = time.time()
-        object_info = self.get_object_info(objects)
+        # Describe objects as they are written instead of building a second
+        # list as long as the listing.
+        object_info = self._iter_object_info(objects)
         output_path = Path(filename)
 
+        # Encode one object at a time, so the whole document is never held in
+        # memory as a single string. Each json.dumps call is one-shot and can
+        # use the C encoder, unlike json.dump. Re-indenting every object by
+        # one level gives the same output as dumping the list with indent=2.
         with output_path.open("w", encoding="utf-8") as f:
-            json.dump(object_info, f, ensure_ascii=False, indent=2)
+            separator = "[\n  "
+            for info in object_info:
+                f.write(separator)
+                f.write(
+                    json.dumps(info, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                )
+                separator = ",\n  "
+            f.write("[]" if separator == "[\n  " else "\n]")
 
         elapsed_time = time.time() - start_time
         self.logger.info(
@@ -152,6 +276,25 @@ class COSObjectDownloader:
             elapsed_time,
         )
 
+    def _download_one(self, key: str, dest_path: Path) -> None:
+        """
+        Download a single object to a local file.
+
+        Args:
+            key: The COS object key.
+            dest_path: The local file path.
+
+        """
+        response = self.client.get_object(Bucket=self.bucket_name, Key=key)
+        # Read the undecoded body, so objects stored with a Content-Encoding
+        # are saved exactly as stored.
+        raw = response["Body"].get_raw_stream()
+        with dest_path.open("wb") as f:
+            while chunk := raw.read(CHUNK_SIZE, decode_content=False):
+                f.write(chunk)
+            # The file is not read back here.
+            drop_page_cache(f)
+
     def download_objects(
         self,
         objects: list[dict[str, Any]],
@@ -161,42 +304,61 @@ class COSObjectDownloader:
         """
         Download objects to a local directory.
 
+        Downloads are latency-bound, so several objects are fetched
+        concurrently from a thread pool of ``max_workers`` threads.
+
         Args:
             objects: The list of objects to download.
             local_dir: The local download directory.
             prefix_filter: A prefix to filter by.
+
         """
         local_path = Path(local_dir)
         local_path.mkdir(exist_ok=True)
 
         downloaded_count = 0
         total_count = len(objects)
+        # Many keys share a parent directory; only create each one once.
+        created_dirs = {local_path}
 
         self.logger.info(
             "Starting download of %d objects to %s...", total_count, local_path
         )
         start_time = time.time()
 
-        for obj in objects:
-            key = obj["Key"]
-            if prefix_filter and not key.startswith(prefix_filter):
-                continue
+        # Bound the number of queued futures so memory does not grow with the
+        # size of the listing.
+        max_pending = self.max_workers * 2
+        pending: dict[Future[None], tuple[str, Path]] = {}
 
-            try:
-                dest_path = local_path / key
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-
-                response = self.client.get_object(Bucket=self.bucket_name, Key=key)
-                with dest_path.open("wb") as f:
-                    f.write(response["Body"].read())
-
-                downloaded_count += 1
-                self.logger.info(
-                    "Downloaded (%d/%d): %s", downloaded_count, total_count, key
-                )
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for obj in objects:
+                key = obj["Key"]
+                if prefix_filter and not key.startswith(prefix_filter):
+                    continue
 
-            except (OSError, ValueError):
-                self.logger.exception("Error downloading %s", key)
+                dest_path = local_path / key
+                try:
+                    # Directories are created here, before submitting, so the
+                    # workers never race on the same parent.
+                    if dest_path.parent not in created_dirs:
+                        dest_path.parent.mkdir(parents=True, exist_ok=True)
+                        created_dirs.add(dest_path.parent)
+                except OSError:
+                    self.logger.exception("Error downloading %s", key)
+                    continue
+
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    downloaded_count = self._collect(
+                        done, pending, downloaded_count, total_count
+                    )
+                future = executor.submit(self._download_one, key, dest_path)
+                pending[future] = (key, dest_path)
+
+            downloaded_count = self._collect(
+                as_completed(list(pending)), pending, downloaded_count, total_count
+            )
 
         elapsed_time = time.time() - start_time
         self.logger.info(
@@ -205,6 +367,50 @@ class COSObjectDownloader:
             elapsed_time,
         )
 
+    def _collect(
+        self,
+        done: Iterable[Future[None]],
+        pending: dict[Future[None], tuple[str, Path]],
+        downloaded_count: int,
+        total_count: int,
+    ) -> int:
+        """
+        Log the results of finished downloads.
+
+        Args:
+            done: The finished futures.
+            pending: The in-flight futures, mapped to their key and local
+                path. Finished futures are removed from it.
+            downloaded_count: The number of objects downloaded so far.
+            total_count: The number of objects in the batch.
+
+        Returns:
+            The number of objects downloaded so far, including these.
+
+        """
+        for future in done:
+            key, dest_path = pending.pop(future)
+            try:
+                future.result()
+            except (
+                CosClientError,
+                CosServiceError,
+                OSError,
+                ValueError,
+                # Connection errors while reading the raw body are not OSErrors.
+                urllib3.exceptions.HTTPError,
+            ):
+                self.logger.exception("Error downloading %s", key)
+                # Do not leave a truncated file that looks like a download.
+                dest_path.unlink(missing_ok=True)
+                continue
+
+            downloaded_count += 1
+            self.logger.info(
+                "Downloaded (%d/%d): %s", downloaded_count, total_count, key
+            )
+        return downloaded_count
+
 
 def get_user_input(prompt: str, default: str | None = None) -> str:
     """
@@ -216,6 +422,7 @@ def get_user_input(prompt: str, default: str | None = None) -> str:
 
     Returns:
         The user's input or the default value.
+
     """
     response = input(prompt).strip()
     if not response and default is not None:
@@ -257,7 +464,7 @@ def main() -> None:
     try:
         downloader = COSObjectDownloader(secret_id, secret_key, region, bucket_name)
         prefix = config.get("options", {}).get("prefix", "")
-        objects = downloader.list_all_objects(prefix=prefix)
+        objects = downloader.list_all_objects_parallel(prefix=prefix)
 
         if not objects:
             logger.info("No objects found.")
@@ -291,7 +498,7 @@ def main() -> None:
         total_time = time.time() - start_time
         logger.info("\nOperation complete! Total time: %.2f seconds", total_time)
 
-    except (OSError, ValueError, KeyError):
+    except (CosClientError, CosServiceError, OSError, ValueError, KeyError):
         logger.exception("An error occurred")
         sys.exit(1)
 
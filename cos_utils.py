@@ -0,0 +1,175 @@
+"""Provides helpers shared by the COS downloaders and the sync detector."""
+
+from __future__ import annotations
+
+import os
+import socket
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from typing import BinaryIO
+
+    from qcloud_cos import CosS3Client
+
+# Seconds a pooled connection may sit idle before TCP keep-alive probes start.
+KEEPALIVE_IDLE = 60
+
+# Downloads at least this large are evicted from the page cache once written.
+DROP_CACHE_MIN_SIZE = 64 * 1024 * 1024
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """An HTTP adapter that enables TCP keep-alive on pooled sockets."""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:  # noqa: ANN401 - forwards HTTPAdapter's arguments unchanged
+        """Create the pool manager with SO_KEEPALIVE set on new sockets."""
+        socket_options = [
+            *HTTPConnection.default_socket_options,
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        # Start probing after a minute idle instead of the system default
+        # (often two hours), so dead pooled connections are noticed quickly.
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            socket_options.append(
+                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+            )
+        kwargs["socket_options"] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def unquote_etag(etag: str) -> str:
+    """
+    Remove the double quotes COS puts around ETags.
+
+    This runs for every listed object, and slicing a known-quoted string is
+    cheaper than str.strip().
+
+    Args:
+        etag: An ETag as returned by COS, quoted or not.
+
+    Returns:
+        The ETag without surrounding quotes.
+
+    """
+    return etag[1:-1] if etag[:1] == '"' else etag
+
+
+def last_key(response: dict[str, Any]) -> str:
+    """
+    Return the marker that continues a listing after this page.
+
+    COS only sends NextMarker when a delimiter is given, so without one the
+    last key (or common prefix) of the page is used instead.
+
+    Args:
+        response: A list_objects response.
+
+    Returns:
+        The marker for the next page, or "" if the page has no entries.
+
+    """
+    if marker := response.get("NextMarker"):
+        return marker
+    keys = [obj["Key"] for obj in response.get("Contents", ())[-1:]]
+    keys.extend(entry["Prefix"] for entry in response.get("CommonPrefixes", ())[-1:])
+    return max(keys, default="")
+
+
+def iter_pages(
+    client: CosS3Client,
+    bucket: str,
+    prefix: str,
+    delimiter: str = "",
+    max_keys: int = 1000,
+) -> Iterator[dict[str, Any]]:
+    """
+    Yield the listing responses for a prefix, page by page.
+
+    The request for the next page is sent as soon as its marker is known, so
+    it is in flight while the caller processes the current page. Errors are
+    not caught here: a listing that stopped part-way would look complete.
+
+    Args:
+        client: The COS client.
+        bucket: The name of the bucket.
+        prefix: The prefix to list.
+        delimiter: An optional delimiter to group keys by.
+        max_keys: The maximum number of entries per page.
+
+    Yields:
+        The list_objects response for each page.
+
+    """
+
+    def fetch_page(marker: str) -> dict[str, Any]:
+        return client.list_objects(
+            Bucket=bucket,
+            Prefix=prefix,
+            Delimiter=delimiter,
+            Marker=marker,
+            MaxKeys=max_keys,
+        )
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="cos-list") as lister:
+        next_page: Future[dict[str, Any]] | None = lister.submit(fetch_page, "")
+        while next_page is not None:
+            response = next_page.result()
+            # The SDK returns IsTruncated as the XML string; accept a bool too.
+            # A page without entries has no key to continue from.
+            truncated = str(response.get("IsTruncated", "")).lower() == "true"
+            marker = last_key(response)
+            if truncated and marker:
+                next_page = lister.submit(fetch_page, marker)
+            else:
+                next_page = None
+            yield response
+
+
+def drop_page_cache(f: BinaryIO) -> None:
+    """
+    Write a finished download back to disk and evict it from the page cache.
+
+    POSIX_FADV_DONTNEED does not drop dirty pages, so the file is written
+    back with fdatasync first. That makes the call a synchronous write, so it
+    is only done on Linux, which honours the advice, and for files of at
+    least DROP_CACHE_MIN_SIZE, whose cached pages would otherwise push out
+    pages that are still in use.
+
+    Args:
+        f: The open file, positioned at its end.
+
+    """
+    if not sys.platform.startswith("linux") or f.tell() < DROP_CACHE_MIN_SIZE:
+        return
+    f.flush()
+    os.fdatasync(f.fileno())
+    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def build_session(pool_size: int) -> requests.Session:
+    """
+    Create an HTTP session with its own keep-alive connection pool.
+
+    CosS3Client otherwise shares one class-wide session, sized by whichever
+    client was created first, so pool settings on a later CosConfig can be
+    silently ignored. Passing this session to CosS3Client avoids that.
+
+    Args:
+        pool_size: The number of connections to keep per host.
+
+    Returns:
+        A session with an adapter of that size mounted for HTTP and HTTPS.
+
+    """
+    adapter = _KeepAliveAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
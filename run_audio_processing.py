@@ -15,10 +15,17 @@ def main() -> None:
     parser.add_argument(
         "destination_directory", help="The directory to save the converted files."
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of concurrent conversions (default: number of CPUs).",
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
-    convert_all_aac_to_wav(args.source_directory, args.destination_directory)
+    convert_all_aac_to_wav(
+        args.source_directory, args.destination_directory, max_workers=args.workers
+    )
 
 
 if __name__ == "__main__":
@@ -1,16 +1,39 @@
 """Sync detector for comparing remote and local files."""
 
+from __future__ import annotations
+
 import logging
-from typing import Any
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Any
+
+from qcloud_cos.cos_exception import CosClientError, CosServiceError
+
+from cos_utils import iter_pages, unquote_etag
+
+if TYPE_CHECKING:
+    import sqlite3
+    from collections.abc import Iterator
 
-from qcloud_cos import CosS3Client
+    from qcloud_cos import CosS3Client
 
-from index_manager import IndexManager
+    from index_manager import IndexManager
+
+# Number of top-level prefixes listed concurrently.
+LIST_WORKERS = 16
+
+
+def _remote_object(row: sqlite3.Row) -> dict[str, Any]:
+    """Rebuild the listing fields of a remote object from a diff row."""
+    return {"Key": row["cos_key"], "ETag": row["etag"], "Size": row["size"]}
 
 
 class SyncDetector:
     """Detect differences between remote COS objects and the local index."""
 
+    __slots__ = ("cos_client", "index_manager", "logger")
+
     def __init__(self, cos_client: CosS3Client, index_manager: IndexManager) -> None:
         """
         Initialize the SyncDetector.
@@ -24,6 +47,105 @@ class SyncDetector:
         self.index_manager = index_manager
         self.logger = logging.getLogger("SyncDetector")
 
+    def _iter_pages(
+        self, bucket_name: str, prefix: str, delimiter: str = ""
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Yield the listing responses for a prefix, page by page.
+
+        Args:
+            bucket_name: The name of the COS bucket.
+            prefix: The prefix to list.
+            delimiter: An optional delimiter to group keys by.
+
+        Yields:
+            The list_objects response for each page.
+
+        Raises:
+            CosClientError, CosServiceError, OSError, ValueError: If a page
+                cannot be listed. A partial listing would make every unlisted
+                object look deleted, so the error is not swallowed.
+
+        """
+        try:
+            yield from iter_pages(self.cos_client, bucket_name, prefix, delimiter)
+        except (CosClientError, CosServiceError, OSError, ValueError):
+            self.logger.exception("Error listing objects under %r", prefix)
+            raise
+
+    def _list_prefix(
+        self, bucket_name: str, prefix: str, delimiter: str = ""
+    ) -> tuple[list[dict[str, Any]], list[str]]:
+        """
+        List the objects under a prefix, page by page.
+
+        Args:
+            bucket_name: The name of the COS bucket.
+            prefix: The prefix to list.
+            delimiter: An optional delimiter to group keys by.
+
+        Returns:
+            The objects found and the common prefixes grouped by the delimiter.
+
+        """
+        objects: list[dict[str, Any]] = []
+        common_prefixes: list[str] = []
+
+        for response in self._iter_pages(bucket_name, prefix, delimiter):
+            if "Contents" in response:
+                objects.extend(response["Contents"])
+            common_prefixes.extend(
+                entry["Prefix"] for entry in response.get("CommonPrefixes", ())
+            )
+
+        return objects, common_prefixes
+
+    def iter_remote_objects(
+        self, bucket_name: str, prefix: str = ""
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Yield all objects in the COS bucket as they are listed.
+
+        Pagination within a prefix is sequential, because each marker comes
+        from the previous page. The keyspace is therefore split on the
+        top-level "/" prefixes, and up to LIST_WORKERS of those are listed
+        concurrently. Shards are submitted as earlier ones are consumed, so
+        at most LIST_WORKERS shard listings are held in memory at once.
+
+        Args:
+            bucket_name: The name of the COS bucket.
+            prefix: An optional prefix to filter objects.
+
+        Yields:
+            Object dictionaries from COS.
+
+        """
+        shards: list[str] = []
+        for response in self._iter_pages(bucket_name, prefix, delimiter="/"):
+            yield from response.get("Contents", ())
+            shards.extend(
+                entry["Prefix"] for entry in response.get("CommonPrefixes", ())
+            )
+        if not shards:
+            return
+
+        workers = min(LIST_WORKERS, len(shards))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="cos-list"
+        ) as executor:
+            remaining = iter(shards)
+            pending = deque(
+                executor.submit(self._list_prefix, bucket_name, shard)
+                for shard in islice(remaining, workers)
+            )
+            while pending:
+                objects, _ = pending.popleft().result()
+                for shard in islice(remaining, 1):
+                    pending.append(
+                        executor.submit(self._list_prefix, bucket_name, shard)
+                    )
+                yield from objects
+
     def list_remote_objects(
         self, bucket_name: str, prefix: str = ""
     ) -> list[dict[str, Any]]:
@@ -38,28 +160,7 @@ class SyncDetector:
             A list of object dictionaries from COS.
 
         """
-        all_objects = []
-        marker = ""
-
-        while True:
-            try:
-                response = self.cos_client.list_objects(
-                    Bucket=bucket_name, Prefix=prefix, Marker=marker, MaxKeys=1000
-                )
-
-                if "Contents" in response:
-                    all_objects.extend(response["Contents"])
-
-                if response.get("IsTruncated") == "true":
-                    marker = response["NextMarker"]
-                else:
-                    break
-
-            except (OSError, ValueError):
-                self.logger.exception("Error listing objects")
-                break
-
-        return all_objects
+        return list(self.iter_remote_objects(bucket_name, prefix))
 
     def get_local_files(self) -> list[dict[str, Any]]:
         """
@@ -90,15 +191,50 @@ class SyncDetector:
         remote_map = {obj["Key"]: obj for obj in remote_objects}
         local_map = {f["cos_key"]: f for f in local_files}
 
-        new_files = [
-            remote_obj for key, remote_obj in remote_map.items() if key not in local_map
-        ]
-        updated_files = [
-            remote_obj
-            for key, remote_obj in remote_map.items()
-            if key in local_map
-            and local_map[key]["etag"] != remote_obj["ETag"].strip('"')
-        ]
-        deleted_files = [local_map[key] for key in local_map if key not in remote_map]
+        # One pass over the remote objects, with a single local lookup each.
+        # The bound methods are hoisted out of the loop.
+        new_files: list[dict[str, Any]] = []
+        updated_files: list[dict[str, Any]] = []
+        get_local = local_map.get
+        add_new = new_files.append
+        add_updated = updated_files.append
+        for key, remote_obj in remote_map.items():
+            local_file = get_local(key)
+            if local_file is None:
+                add_new(remote_obj)
+            elif local_file["etag"] != unquote_etag(remote_obj["ETag"]):
+                add_updated(remote_obj)
+        deleted_files = [local_map[key] for key in local_map.keys() - remote_map.keys()]
 
         return {"new": new_files, "updated": updated_files, "deleted": deleted_files}
+
+    def detect_changes(
+        self, bucket_name: str, prefix: str = ""
+    ) -> dict[str, list[dict[str, Any]]]:
+        """
+        List the bucket and compare it with the local index in SQL.
+
+        This is equivalent to compare_objects on the remote listing and all
+        local files, but the index is never loaded into Python and the
+        listing is streamed into SQLite shard by shard. Memory is bounded by
+        the shards in flight (see iter_remote_objects) and the differences
+        returned.
+
+        Args:
+            bucket_name: The name of the COS bucket.
+            prefix: An optional prefix to filter objects.
+
+        Returns:
+            A dictionary containing lists of new, updated, and deleted files.
+
+        """
+        new_rows, updated_rows, deleted_files = self.index_manager.diff_remote(
+            (obj["Key"], unquote_etag(obj["ETag"]), int(obj["Size"]))
+            for obj in self.iter_remote_objects(bucket_name, prefix)
+        )
+
+        return {
+            "new": [_remote_object(row) for row in new_rows],
+            "updated": [_remote_object(row) for row in updated_rows],
+            "deleted": deleted_files,
+        }
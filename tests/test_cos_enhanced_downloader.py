@@ -1,9 +1,25 @@
 """Unit tests for the EnhancedCOSDownloader class."""
 
+import gzip
+import hashlib
+import io
+import tempfile
 import unittest
+from pathlib import Path
 from unittest.mock import MagicMock, mock_open, patch
 
-from cos_enhanced_downloader import EnhancedCOSDownloader
+from qcloud_cos.cos_exception import CosClientError
+from urllib3.exceptions import ProtocolError
+
+from cos_enhanced_downloader import EnhancedCOSDownloader, _ConcurrencyTuner
+
+
+def _raw_stream(data: bytes) -> MagicMock:
+    """Return a mock of the SDK's raw (undecoded) stream serving data."""
+    buffer = io.BytesIO(data)
+    stream = MagicMock()
+    stream.read.side_effect = lambda amt, **_: buffer.read(amt)
+    return stream
 
 
 class TestEnhancedCOSDownloader(unittest.TestCase):
@@ -18,19 +34,16 @@ class TestEnhancedCOSDownloader(unittest.TestCase):
 
         # Mock the config loading
         mock_config = {
-            "secret_id": "test_id",
-            "secret_key": "test_key",
-            "region": "ap-beijing",
-            "bucket": "test-bucket",
+            "cos_config": {
+                "secret_id": "test_id",
+                "secret_key": "test_key",
+                "region": "ap-beijing",
+                "bucket_name": "test-bucket",
+            }
         }
 
         with (
-            patch(
-                "builtins.open",
-                mock_open(
-                    read_data='{"secret_id": "test_id", "secret_key": "test_key", "region": "ap-beijing", "bucket": "test-bucket"}'
-                ),
-            ),
+            patch("pathlib.Path.open", mock_open(read_data="{}")),
             patch("json.load", return_value=mock_config),
             patch("cos_enhanced_downloader.CosConfig"),
             patch("cos_enhanced_downloader.logging.getLogger"),
@@ -63,63 +76,262 @@ class TestEnhancedCOSDownloader(unittest.TestCase):
         assert len(objects) == 2
         assert objects[0]["Key"] == "file1.txt"
 
+    def test_list_objects_paginates(self) -> None:
+        """Test that truncated listings continue from the last key."""
+        self.downloader.client.list_objects.side_effect = [
+            {"Contents": [{"Key": "a.txt", "Size": 1}], "IsTruncated": "true"},
+            {"Contents": [{"Key": "b.txt", "Size": 1}], "IsTruncated": "false"},
+        ]
+
+        objects = self.downloader.list_objects()
+
+        assert [obj["Key"] for obj in objects] == ["a.txt", "b.txt"]
+        second_call = self.downloader.client.list_objects.call_args_list[1]
+        assert second_call.kwargs["Marker"] == "a.txt"
+
     def test_download_single_file_new(self) -> None:
         """Test downloading a new file."""
         self.downloader.index_manager.file_exists.return_value = False
 
         mock_response = MagicMock()
-        mock_response["Body"].read.return_value = b"test content"
+        mock_response["Body"].get_raw_stream.return_value = _raw_stream(b"test content")
         self.downloader.client.get_object.return_value = mock_response
 
-        with (
-            patch("builtins.open", mock_open()) as mock_file,
-            patch("os.path.exists", return_value=False),
-            patch("os.makedirs"),
-            patch("index_manager.IndexManager.calculate_md5", return_value="mock_md5"),
-        ):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local_path = Path(tmp_dir) / "file1.txt"
             result = self.downloader._download_single_file(
-                "file1.txt", "local/file1.txt", 1024, "etag1"
+                "file1.txt", local_path, 12, "9473fdd0d880a43c21b7778d34872157"
             )
 
             assert result == "success"
-            self.downloader.index_manager.add_file.assert_called_once()
+            assert local_path.read_bytes() == b"test content"
+            self.downloader.index_manager.queue_file.assert_called_once()
 
-    def test_download_single_file_skipped(self) -> None:
-        """Test skipping an already downloaded file."""
-        self.downloader.index_manager.file_exists.return_value = True
+    def test_download_single_file_keeps_content_encoding(self) -> None:
+        """Test that encoded objects are saved as stored, not decoded."""
+        stored = gzip.compress(b"test content")
+        raw_stream = _raw_stream(stored)
+        body = MagicMock()
+        body.get_raw_stream.return_value = raw_stream
+        self.downloader.client.get_object.return_value = {
+            "Body": body,
+            "Content-Encoding": "gzip",
+        }
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local_path = Path(tmp_dir) / "file1.txt.gz"
+            result = self.downloader._download_single_file(
+                "file1.txt.gz",
+                local_path,
+                len(stored),
+                hashlib.md5(stored, usedforsecurity=False).hexdigest(),
+            )
 
-        result = self.downloader._download_single_file(
-            "file1.txt", "local/file1.txt", 1024, "etag1"
+            assert result == "success"
+            assert local_path.read_bytes() == stored
+        assert all(
+            call.kwargs["decode_content"] is False
+            for call in raw_stream.read.call_args_list
         )
 
-        assert result == "skipped"
+    def test_download_single_file_retries_dropped_connection(self) -> None:
+        """Test that a connection dropped mid-body is retried, then reported."""
+        raw_stream = MagicMock()
+        raw_stream.read.side_effect = ProtocolError("Connection broken")
+        self.downloader.client.get_object.return_value = {
+            "Body": MagicMock(get_raw_stream=MagicMock(return_value=raw_stream))
+        }
+        self.downloader.retry_times = 2
+
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            patch("cos_enhanced_downloader.time.sleep"),
+        ):
+            result = self.downloader._download_single_file(
+                "file1.txt", Path(tmp_dir) / "file1.txt", 12, "etag1"
+            )
+
+        assert result == "failed"
+        assert self.downloader.client.get_object.call_count == 2
+
+    def test_download_single_file_retries_client_errors(self) -> None:
+        """Test that SDK connection errors are retried like other failures."""
+        self.downloader.client.get_object.side_effect = [
+            CosClientError("connection timed out"),
+            {"Body": MagicMock(get_raw_stream=lambda: _raw_stream(b"test content"))},
+        ]
+
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            patch("cos_enhanced_downloader.time.sleep"),
+        ):
+            result = self.downloader._download_single_file(
+                "file1.txt", Path(tmp_dir) / "file1.txt", 12, "etag1"
+            )
+
+        assert result == "success"
+        assert self.downloader.client.get_object.call_count == 2
+
+    def test_download_single_file_removes_corrupt_file(self) -> None:
+        """Test that a file failing verification is not left for later runs."""
+        self.downloader.client.get_object.side_effect = lambda **_: {
+            "Body": MagicMock(
+                get_raw_stream=MagicMock(return_value=_raw_stream(b"test content"))
+            )
+        }
+        self.downloader.retry_times = 2
+
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            patch("cos_enhanced_downloader.time.sleep"),
+        ):
+            local_path = Path(tmp_dir) / "file1.txt"
+            result = self.downloader._download_single_file(
+                "file1.txt", local_path, 12, "0" * 32
+            )
+
+            assert result == "failed"
+            assert not local_path.exists()
+
+    def test_download_objects_skips_indexed(self) -> None:
+        """Test skipping an already downloaded file before it is scheduled."""
+        objects = [{"Key": "file1.txt", "Size": 1024, "ETag": '"etag1"'}]
+        self.downloader.index_manager.file_exists_many.return_value = {
+            ("file1.txt", "etag1")
+        }
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = self.downloader.download_objects(
+                objects, output_dir=tmp_dir, show_progress=False
+            )
+
+        assert result == {"success": 0, "failed": 0, "skipped": 1}
+        self.downloader.client.get_object.assert_not_called()
+
+    def test_download_single_file_large_uses_ranges(self) -> None:
+        """Test that large objects are fetched with ranged downloads."""
+        self.downloader.client.download_file.side_effect = lambda **kwargs: Path(
+            kwargs["DestFilePath"]
+        ).write_bytes(b"test content")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = self.downloader._download_single_file(
+                "big.wav", Path(tmp_dir) / "big.wav", 128 * 1024 * 1024, "etag-2"
+            )
+
+        assert result == "success"
         self.downloader.client.get_object.assert_not_called()
+        self.downloader.client.download_file.assert_called_once()
+
+    def test_md5_from_etag(self) -> None:
+        """Test that only single-part ETags are reused as MD5 digests."""
+        single_part = "5EB63BBBE01EEED093CB22BB8F5ACDC3"
+        multipart = "5eb63bbbe01eeed093cb22bb8f5acdc3-4"
+
+        assert self.downloader._md5_from_etag(single_part) == single_part.lower()
+        assert self.downloader._md5_from_etag(multipart) is None
+
+    def test_worker_count_scales_with_object_size(self) -> None:
+        """Test that the automatic worker count follows the median object size."""
+        cpu_count = self.downloader._cpu_count
+
+        assert self.downloader._worker_count([1024] * 10) == cpu_count * 8
+        assert self.downloader._worker_count([128 * 1024 * 1024]) == cpu_count
+
+        self.downloader._auto_workers = False
+        assert self.downloader._worker_count([1024]) == self.downloader.max_workers
+
+    def test_concurrency_tuner_follows_throughput(self) -> None:
+        """Test that the tuner climbs, holds on flat rates and reverses on drops."""
+        with patch("cos_enhanced_downloader.time.monotonic", return_value=0.0):
+            tuner = _ConcurrencyTuner(8, maximum=32, step=4, window=5.0)
+
+        with patch(
+            "cos_enhanced_downloader.time.monotonic",
+            side_effect=[5.0, 10.0, 15.0, 20.0, 25.0],
+        ):
+            tuner.record(1000)
+            assert tuner.limit == 12
+            tuner.record(1500)
+            assert tuner.limit == 16
+            tuner.record(1550)
+            assert tuner.limit == 16
+            tuner.record(1000)
+            assert tuner.limit == 12
+            tuner.record(800)
+            assert tuner.limit == 16
+
+    def test_concurrency_tuner_holds_at_the_knee(self) -> None:
+        """Test that a plateaued link keeps the limit near its saturation point."""
+        knee = 16
+        with patch("cos_enhanced_downloader.time.monotonic", return_value=0.0):
+            tuner = _ConcurrencyTuner(4, maximum=64, step=4, window=5.0)
+
+        limits = []
+        for window in range(1, 21):
+            with patch(
+                "cos_enhanced_downloader.time.monotonic", return_value=window * 5.0
+            ):
+                # Throughput grows with the streams until the link saturates.
+                tuner.record(min(tuner.limit, knee) * 1000)
+            limits.append(tuner.limit)
+
+        assert all(knee <= limit <= knee + 4 for limit in limits[5:])
 
     def test_download_objects(self) -> None:
         """Test downloading multiple objects."""
         objects = [
-            {"Key": "file1.txt", "Size": 1024, "ETag": '"etag1"'},
-            {"Key": "file2.txt", "Size": 2048, "ETag": '"etag2"'},
+            {"Key": "file1.txt", "Size": 12, "ETag": '"etag1"'},
+            {"Key": "file2.txt", "Size": 12, "ETag": '"etag2"'},
         ]
 
         self.downloader.index_manager.file_exists.return_value = False
 
         mock_response = MagicMock()
-        mock_response["Body"].read.return_value = b"test content"
+        mock_response["Body"].get_raw_stream.side_effect = lambda: _raw_stream(
+            b"test content"
+        )
         self.downloader.client.get_object.return_value = mock_response
 
-        with (
-            patch("builtins.open", mock_open()),
-            patch("os.path.exists", return_value=False),
-            patch("os.makedirs"),
-            patch("index_manager.IndexManager.calculate_md5", return_value="mock_md5"),
-        ):
-            result = self.downloader.download_objects(objects, show_progress=False)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = self.downloader.download_objects(
+                objects, output_dir=tmp_dir, show_progress=False
+            )
 
             assert result["success"] == 2
             assert result["failed"] == 0
             assert result["skipped"] == 0
 
+    def test_download_objects_from_iterator(self) -> None:
+        """Test downloading objects while they are still being listed."""
+        objects = (
+            {"Key": f"file{i}.txt", "Size": 12, "ETag": f'"etag{i}"'} for i in range(3)
+        )
+
+        self.downloader.index_manager.file_exists.return_value = False
+
+        mock_response = MagicMock()
+        mock_response["Body"].get_raw_stream.side_effect = lambda: _raw_stream(
+            b"test content"
+        )
+        self.downloader.client.get_object.return_value = mock_response
+
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            patch.object(
+                self.downloader,
+                "_worker_count",
+                wraps=self.downloader._worker_count,
+            ) as worker_count,
+        ):
+            result = self.downloader.download_objects(
+                objects, output_dir=tmp_dir, show_progress=False
+            )
+
+            assert result == {"success": 3, "failed": 0, "skipped": 0}
+        # Workers are sized from the leading objects even without a list.
+        worker_count.assert_called_once_with([12, 12, 12])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -11,28 +11,21 @@ class TestIndexManager(unittest.TestCase):
     """Unit tests for the IndexManager class."""
 
     def setUp(self) -> None:
-        """Set up a temporary database for each test."""
-        self.db_path = "test_index.db"
-        self.index_manager = IndexManager(db_path=self.db_path)
+        """Set up an in-memory database for each test."""
+        self.index_manager = IndexManager(db_path=":memory:")
 
     def tearDown(self) -> None:
-        """Clean up the temporary database after each test."""
+        """Close the database after each test."""
         self.index_manager.close()
-        if Path(self.db_path).exists():
-            Path(self.db_path).unlink()
 
     def test_initialization_creates_table(self) -> None:
         """Test if the table is created upon initialization."""
-        # Check if the table exists
-        import sqlite3
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        # An in-memory database is private to its connection, so query it
+        # through the manager's own connection.
+        cursor = self.index_manager._get_connection().execute(
             "SELECT name FROM sqlite_master WHERE type='table' AND name='local_files'"
         )
         assert cursor.fetchone() is not None
-        conn.close()
 
     def test_add_and_get_file(self) -> None:
         """Test adding a file and retrieving it."""
@@ -58,6 +51,40 @@ class TestIndexManager(unittest.TestCase):
         all_files = self.index_manager.get_all_files()
         assert len(all_files) == 2
 
+    def test_add_files_bulk(self) -> None:
+        """Test adding several files in one transaction."""
+        rows = [
+            {
+                "file_path": f"path{i}",
+                "file_size": i,
+                "last_modified": "mod",
+                "md5_hash": "md5",
+                "cos_key": f"key{i}",
+                "etag": "etag",
+            }
+            for i in range(3)
+        ]
+        self.index_manager.add_files_bulk(rows)
+
+        assert len(self.index_manager.get_all_files()) == 3
+
+    def test_queue_file_and_flush(self) -> None:
+        """Test that queued files are written on flush."""
+        self.index_manager.queue_file(
+            {
+                "file_path": "path1",
+                "file_size": 1,
+                "last_modified": "mod1",
+                "md5_hash": "md5_1",
+                "cos_key": "key1",
+                "etag": "etag1",
+            }
+        )
+        assert self.index_manager.get_file("path1") is None
+
+        self.index_manager.flush()
+        assert self.index_manager.file_exists("key1", "etag1")
+
     def test_remove_file(self) -> None:
         """Test removing a file."""
         self.index_manager.add_file("path1", 1, "mod1", "md5_1", "key1", "etag1")
@@ -73,6 +100,30 @@ class TestIndexManager(unittest.TestCase):
         assert self.index_manager.file_exists("key1", "etag1")
         assert not self.index_manager.file_exists("key2", "etag2")
 
+    def test_file_exists_many(self) -> None:
+        """Test checking several files in one query."""
+        self.index_manager.add_file("path1", 1, "mod1", "md5_1", "key1", "etag1")
+        self.index_manager.add_file("path2", 2, "mod2", "md5_2", "key2", "etag2")
+
+        found = self.index_manager.file_exists_many(
+            [("key1", "etag1"), ("key2", "new_etag"), ("key3", "etag3")]
+        )
+        assert found == {("key1", "etag1")}
+
+    def test_diff_remote(self) -> None:
+        """Test comparing remote objects with the index in SQL."""
+        self.index_manager.add_file("path1", 1, "mod1", "md5_1", "key1", "etag1")
+        self.index_manager.add_file("path2", 2, "mod2", "md5_2", "key2", "etag2")
+        self.index_manager.add_file("path4", 4, "mod4", "md5_4", "key4", "etag4")
+
+        new_rows, updated_rows, deleted = self.index_manager.diff_remote(
+            [("key1", "etag1", 1), ("key2", "new_etag", 2), ("key3", "etag3", 3)]
+        )
+
+        assert [tuple(row) for row in new_rows] == [("key3", "etag3", 3)]
+        assert [tuple(row) for row in updated_rows] == [("key2", "new_etag", 2)]
+        assert [row["cos_key"] for row in deleted] == ["key4"]
+
     def test_calculate_md5(self) -> None:
         """Test the MD5 calculation."""
         # Create a dummy file
@@ -85,6 +136,18 @@ class TestIndexManager(unittest.TestCase):
 
         Path(file_path).unlink()
 
+    def test_calculate_md5_batch(self) -> None:
+        """Test hashing several files at once."""
+        paths = ["dummy_file1.txt", "dummy_file2.txt"]
+        for path in paths:
+            Path(path).write_text("hello world")
+
+        hashes = self.index_manager.calculate_md5_batch(paths)
+        assert hashes == dict.fromkeys(paths, "5eb63bbbe01eeed093cb22bb8f5acdc3")
+
+        for path in paths:
+            Path(path).unlink()
+
 
 if __name__ == "__main__":
     unittest.main()
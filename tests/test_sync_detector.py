@@ -3,6 +3,9 @@
 import unittest
 from unittest.mock import MagicMock
 
+import pytest
+from qcloud_cos.cos_exception import CosClientError
+
 from sync_detector import SyncDetector
 
 
@@ -43,8 +46,88 @@ class TestSyncDetector(unittest.TestCase):
         assert len(diff["updated"]) == 1
         assert diff["updated"][0]["Key"] == "file2.txt"
 
-        # For now, 'deleted' is a placeholder
-        assert len(diff["deleted"]) == 0
+        assert len(diff["deleted"]) == 1
+        assert diff["deleted"][0]["cos_key"] == "file4.txt"
+
+    def test_list_remote_objects_stops_after_last_page(self) -> None:
+        """Test that pagination follows IsTruncated without extra requests."""
+        self.mock_cos_client.list_objects.side_effect = [
+            {
+                "Contents": [{"Key": "a.txt"}],
+                "IsTruncated": "true",
+                "NextMarker": "a.txt",
+            },
+            {"Contents": [{"Key": "b.txt"}], "IsTruncated": True},
+            {"Contents": [{"Key": "c.txt"}], "IsTruncated": "false"},
+        ]
+
+        objects = self.detector.list_remote_objects("test-bucket")
+
+        assert [obj["Key"] for obj in objects] == ["a.txt", "b.txt", "c.txt"]
+        assert self.mock_cos_client.list_objects.call_count == 3
+        markers = [
+            call.kwargs["Marker"]
+            for call in self.mock_cos_client.list_objects.call_args_list
+        ]
+        assert markers == ["", "a.txt", "b.txt"]
+
+    def test_list_remote_objects_shards_by_prefix(self) -> None:
+        """Test that top-level prefixes are listed separately."""
+
+        def list_objects(**kwargs: str) -> dict:
+            if kwargs["Delimiter"] == "/":
+                return {
+                    "Contents": [{"Key": "root.txt"}],
+                    "CommonPrefixes": [{"Prefix": "a/"}, {"Prefix": "b/"}],
+                }
+            return {"Contents": [{"Key": kwargs["Prefix"] + "file.txt"}]}
+
+        self.mock_cos_client.list_objects.side_effect = list_objects
+
+        objects = self.detector.list_remote_objects("test-bucket")
+
+        assert sorted(obj["Key"] for obj in objects) == [
+            "a/file.txt",
+            "b/file.txt",
+            "root.txt",
+        ]
+
+    def test_detect_changes_streams_listing_into_index(self) -> None:
+        """Test that listed objects are passed to the index diff unquoted."""
+        self.mock_cos_client.list_objects.return_value = {
+            "Contents": [{"Key": "file1.txt", "ETag": '"etag1"', "Size": "3"}]
+        }
+        received = []
+
+        def diff_remote(objects: list) -> tuple:
+            received.extend(objects)
+            return [{"cos_key": "file1.txt", "etag": "etag1", "size": 3}], [], []
+
+        self.mock_index_manager.diff_remote.side_effect = diff_remote
+
+        diff = self.detector.detect_changes("test-bucket")
+
+        assert received == [("file1.txt", "etag1", 3)]
+        assert diff["new"] == [{"Key": "file1.txt", "ETag": "etag1", "Size": 3}]
+        assert diff["updated"] == []
+
+    def test_detect_changes_raises_on_listing_error(self) -> None:
+        """Test that a failed page aborts the diff instead of truncating it."""
+        self.mock_cos_client.list_objects.side_effect = [
+            {
+                "Contents": [{"Key": "a.txt", "ETag": '"a"', "Size": "1"}],
+                "IsTruncated": "true",
+            },
+            CosClientError("connection reset"),
+        ]
+        self.mock_index_manager.diff_remote.side_effect = lambda objects: (
+            list(objects),
+            [],
+            [],
+        )
+
+        with pytest.raises(CosClientError):
+            self.detector.detect_changes("test-bucket")
 
 
 if __name__ == "__main__":